@@ -312,13 +312,14 @@ async def update_notification_settings(
 
 @router.get("/api-keys")
 async def get_api_keys(
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取得 API 金鑰列表"""
     
     # 檢查使用者是否有 API 存取權限
     from subscription_service import subscription_service
-    plan = subscription_service.get_user_plan(current_user.id)
+    plan = subscription_service.get_user_plan(db, current_user.id)
     
     if not plan.api_access:
         raise HTTPException(
@@ -337,13 +338,14 @@ async def get_api_keys(
 @router.post("/api-keys")
 async def create_api_key(
     name: str,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """建立新的 API 金鑰"""
     
     # 檢查使用者是否有 API 存取權限
     from subscription_service import subscription_service
-    plan = subscription_service.get_user_plan(current_user.id)
+    plan = subscription_service.get_user_plan(db, current_user.id)
     
     if not plan.api_access:
         raise HTTPException(
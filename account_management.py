@@ -1,15 +1,11 @@
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 
 from models_extended import User, SessionLocal
 from subscription_models import UserSubscription, Payment, Invoice
 from subscription_service import subscription_service
-from utils import safe_json_loads, safe_json_dumps
-
-# 密碼加密
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from utils import safe_json_loads, safe_json_dumps, pwd_context
 
 class AccountManagementService:
     """帳戶管理服務"""
@@ -25,9 +21,8 @@ class AccountManagementService:
             return {"error": "User not found"}
         
         # 取得訂閱資訊
-        subscription = subscription_service.get_user_subscription(user_id)
-        plan = subscription_service.get_user_plan(user_id)
-        quota = subscription_service.get_usage_quota(user_id)
+        subscription, plan = subscription_service.get_user_subscription_with_plan(self.db, user_id)
+        quota = subscription_service.get_usage_quota(self.db, user_id)
         
         # 計算帳戶統計
         total_projects = self.db.query(Project).filter(Project.user_id == user_id).count()
@@ -209,8 +204,8 @@ class AccountManagementService:
         
         while current_date <= end_date:
             month_str = current_date.strftime("%Y-%m")
-            quota = subscription_service.get_usage_quota(user_id, month_str)
-            plan = subscription_service.get_user_plan(user_id)
+            quota = subscription_service.get_usage_quota(self.db, user_id, month_str)
+            plan = subscription_service.get_user_plan(self.db, user_id)
             
             monthly_usage.append({
                 "month": month_str,
@@ -263,10 +258,10 @@ class AccountManagementService:
         
         try:
             # 取消所有活躍訂閱
-            subscription = subscription_service.get_user_subscription(user_id)
+            subscription = subscription_service.get_user_subscription(self.db, user_id)
             if subscription:
                 subscription_service.cancel_subscription(
-                    user_id, "Account deletion requested"
+                    self.db, user_id, "Account deletion requested"
                 )
             
             # 刪除使用者相關資料
@@ -112,6 +112,7 @@ class BackgroundTaskManager:
                     version_name=version_name,
                     file_path=output_path,
                     edit_operations=safe_json_dumps(edit_operations),
+                    edit_operations_count=len(edit_operations),
                     edit_summary=self._generate_edit_summary(edit_operations),
                     duration_seconds=result.get("new_duration"),
                     file_size_bytes=os.path.getsize(output_path) if os.path.exists(output_path) else 0
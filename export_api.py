@@ -76,8 +76,8 @@ async def export_audio(
         )
     
     # 檢查配額
-    plan = subscription_service.get_user_plan(current_user.id)
-    if not subscription_service.check_quota(current_user.id, "exports", 1):
+    plan = subscription_service.get_user_plan(db, current_user.id)
+    if not subscription_service.check_quota(db, current_user.id, "exports", 1):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Export quota exceeded for {plan.display_name} plan"
@@ -97,7 +97,7 @@ async def export_audio(
         )
     
     # 消耗配額
-    subscription_service.consume_quota(current_user.id, "exports", 1)
+    subscription_service.consume_quota(db, current_user.id, "exports", 1)
     
     # 安排清理暫存檔案
     background_tasks.add_task(
@@ -145,8 +145,8 @@ async def export_transcript(
         )
     
     # 檢查配額
-    plan = subscription_service.get_user_plan(current_user.id)
-    if not subscription_service.check_quota(current_user.id, "exports", 1):
+    plan = subscription_service.get_user_plan(db, current_user.id)
+    if not subscription_service.check_quota(db, current_user.id, "exports", 1):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Export quota exceeded for {plan.display_name} plan"
@@ -196,7 +196,7 @@ async def export_transcript(
         )
     
     # 消耗配額
-    subscription_service.consume_quota(current_user.id, "exports", 1)
+    subscription_service.consume_quota(db, current_user.id, "exports", 1)
     
     # 安排清理暫存檔案
     background_tasks.add_task(
@@ -238,12 +238,12 @@ async def batch_export(
     
     # 檢查配額
     total_exports = len(request.audio_file_ids) * len(request.export_types)
-    plan = subscription_service.get_user_plan(current_user.id)
+    plan = subscription_service.get_user_plan(db, current_user.id)
     
-    if not subscription_service.check_quota(current_user.id, "exports", total_exports):
+    if not subscription_service.check_quota(db, current_user.id, "exports", total_exports):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Export quota exceeded. Requested: {total_exports}, Available: {plan.exports_per_month - subscription_service.get_usage(current_user.id, 'exports')}"
+            detail=f"Export quota exceeded. Requested: {total_exports}, Available: {plan.exports_per_month - subscription_service.get_usage(db, current_user.id, 'exports')}"
         )
     
     # 執行批量匯出
@@ -309,7 +309,7 @@ async def batch_export(
         
         if package_result["success"]:
             # 消耗配額
-            subscription_service.consume_quota(current_user.id, "exports", total_exports)
+            subscription_service.consume_quota(db, current_user.id, "exports", total_exports)
             
             # 安排清理暫存檔案
             background_tasks.add_task(
@@ -330,7 +330,7 @@ async def batch_export(
     first_export = exports[0]
     
     # 消耗配額
-    subscription_service.consume_quota(current_user.id, "exports", len(exports))
+    subscription_service.consume_quota(db, current_user.id, "exports", len(exports))
     
     # 安排清理暫存檔案
     background_tasks.add_task(
@@ -392,12 +392,13 @@ async def download_file(
 
 @router.get("/formats")
 async def get_supported_formats(
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取得支援的匯出格式"""
     
     formats = export_service.get_supported_formats()
-    plan = subscription_service.get_user_plan(current_user.id)
+    plan = subscription_service.get_user_plan(db, current_user.id)
     
     # 根據訂閱方案限制某些格式
     if plan.name == "free":
@@ -413,19 +414,20 @@ async def get_supported_formats(
         "plan_restrictions": {
             "plan_name": plan.display_name,
             "exports_per_month": plan.exports_per_month,
-            "exports_used": subscription_service.get_usage(current_user.id, "exports"),
-            "exports_remaining": plan.exports_per_month - subscription_service.get_usage(current_user.id, "exports")
+            "exports_used": subscription_service.get_usage(db, current_user.id, "exports"),
+            "exports_remaining": plan.exports_per_month - subscription_service.get_usage(db, current_user.id, "exports")
         }
     }
 
 @router.get("/quota")
 async def get_export_quota(
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取得匯出配額資訊"""
     
-    plan = subscription_service.get_user_plan(current_user.id)
-    usage = subscription_service.get_usage(current_user.id, "exports")
+    plan = subscription_service.get_user_plan(db, current_user.id)
+    usage = subscription_service.get_usage(db, current_user.id, "exports")
     
     return {
         "plan_name": plan.display_name,
@@ -433,7 +435,7 @@ async def get_export_quota(
         "exports_used": usage,
         "exports_remaining": max(0, plan.exports_per_month - usage),
         "usage_percentage": (usage / plan.exports_per_month * 100) if plan.exports_per_month > 0 else 0,
-        "reset_date": subscription_service.get_quota_reset_date(current_user.id)
+        "reset_date": subscription_service.get_quota_reset_date(db, current_user.id)
     }
 
 # ==================== 匯出歷史 API ====================
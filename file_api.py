@@ -458,11 +458,12 @@ async def get_storage_analytics(
 
 @router.get("/storage/quota")
 async def get_storage_quota(
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取得儲存配額資訊"""
     
-    plan = subscription_service.get_user_plan(current_user.id)
+    plan = subscription_service.get_user_plan(db, current_user.id)
     current_usage_bytes = file_service.get_user_storage_usage(current_user.id)
     current_usage_gb = current_usage_bytes / (1024 * 1024 * 1024)
     
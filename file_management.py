@@ -1,6 +1,5 @@
 import os
 import shutil
-import hashlib
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List, Tuple
 from pathlib import Path
@@ -10,7 +9,7 @@ import asyncio
 from sqlalchemy.orm import Session
 from models_extended import SessionLocal, Project, AudioFile
 from subscription_service import subscription_service
-from utils import safe_json_loads, safe_json_dumps, generate_unique_filename
+from utils import safe_json_loads, safe_json_dumps, generate_unique_filename, file_digest
 
 class FileManagementService:
     """檔案管理服務"""
@@ -62,12 +61,8 @@ class FileManagementService:
         return project_path
     
     def calculate_file_hash(self, file_path: str) -> str:
-        """計算檔案 MD5 雜湊值"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """計算檔案 MD5 雜湊值（維持既有 file_hash 格式）"""
+        return file_digest(file_path, "md5")
     
     def validate_audio_file(self, file_path: str, user_id: int) -> Dict[str, Any]:
         """驗證音訊檔案"""
@@ -81,7 +76,7 @@ class FileManagementService:
         
         # 檢查檔案大小
         file_size = os.path.getsize(file_path)
-        plan = subscription_service.get_user_plan(user_id)
+        plan = subscription_service.get_user_plan(self.db, user_id)
         size_limit = self.file_size_limits.get(plan.name, self.file_size_limits["free"])
         
         if file_size > size_limit:
@@ -148,7 +143,7 @@ class FileManagementService:
             
             # 更新儲存配額
             subscription_service.consume_quota(
-                user_id, "storage", file_size / (1024 * 1024 * 1024)
+                self.db, user_id, "storage", file_size / (1024 * 1024 * 1024)
             )
             
             return {
@@ -238,7 +233,7 @@ class FileManagementService:
             
             # 更新儲存配額
             subscription_service.consume_quota(
-                user_id, "storage", -(file_size / (1024 * 1024 * 1024))
+                self.db, user_id, "storage", -(file_size / (1024 * 1024 * 1024))
             )
             
             return {
@@ -333,7 +328,7 @@ class FileManagementService:
             
             # 更新儲存配額
             subscription_service.consume_quota(
-                user_id, "storage", file_size / (1024 * 1024 * 1024)
+                self.db, user_id, "storage", file_size / (1024 * 1024 * 1024)
             )
             
             return {
@@ -376,7 +371,7 @@ class FileManagementService:
         
         try:
             user_path = self.get_user_storage_path(user_id)
-            plan = subscription_service.get_user_plan(user_id)
+            plan = subscription_service.get_user_plan(self.db, user_id)
             
             # 計算各專案的使用量
             projects_usage = {}
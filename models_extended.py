@@ -1,14 +1,50 @@
 import os
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, UniqueConstraint, ForeignKey, Float, Text
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Boolean, DateTime, UniqueConstraint, ForeignKey, Float, Text
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 
 # 檢查環境變數中是否有指定資料庫路徑，若無，則使用預設的持久化路徑
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:////var/data/trimly.db")
 
 print(f"Initializing database at: {DATABASE_URL}")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# 連線池設定（所有路由透過 get_db 共用同一個連線池）
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "20"))
+POOL_MAX_OVERFLOW = int(os.environ.get("DB_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT_SECONDS = 30
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+if IS_SQLITE:
+    # SQLite 檔案資料庫：明確使用 QueuePool 重複利用連線
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT_SECONDS
+    )
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        """啟用 WAL 模式，減少每次寫入的 fsync 次數"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
@@ -110,6 +146,7 @@ class AudioVersion(Base):
     
     # 編輯記錄
     edit_operations = Column(Text)  # JSON 格式記錄所有編輯操作
+    edit_operations_count = Column(Integer, default=0)  # 編輯操作數量（避免重複解析 JSON）
     edit_summary = Column(String)  # 人類可讀的編輯摘要
     
     # 檔案資訊
@@ -173,8 +210,79 @@ class UsageLog(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
 
+def _migrate_audio_versions():
+    """為既有的 audio_versions 資料表補上 edit_operations_count 欄位"""
+    columns = {col["name"] for col in inspect(engine).get_columns("audio_versions")}
+    if "edit_operations_count" in columns:
+        return
+
+    import json
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE audio_versions ADD COLUMN edit_operations_count INTEGER DEFAULT 0"))
+        rows = conn.execute(text("SELECT id, edit_operations FROM audio_versions")).all()
+        for version_id, edit_operations in rows:
+            try:
+                count = len(json.loads(edit_operations)) if edit_operations else 0
+            except (ValueError, TypeError):
+                count = 0
+            conn.execute(
+                text("UPDATE audio_versions SET edit_operations_count = :count WHERE id = :id"),
+                {"count": count, "id": version_id}
+            )
+
+def _merge_duplicate_usage_quotas():
+    """合併同一使用者同月份的重複配額記錄（用量加總至最小 id），以便建立唯一索引"""
+    indexes = {index["name"] for index in inspect(engine).get_indexes("usage_quotas")}
+    if "uq_quota_user_month" in indexes:
+        return
+
+    usage_columns = ("transcription_minutes_used", "ai_enhancements_used",
+                     "ai_summaries_used", "storage_gb_used")
+    totals = ", ".join(
+        f"{column} = (SELECT SUM(COALESCE(q.{column}, 0)) FROM usage_quotas q "
+        f"WHERE q.user_id = usage_quotas.user_id AND q.quota_month = usage_quotas.quota_month)"
+        for column in usage_columns
+    )
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"UPDATE usage_quotas SET {totals} WHERE id IN ("
+            "SELECT MIN(id) FROM usage_quotas GROUP BY user_id, quota_month HAVING COUNT(*) > 1)"
+        ))
+        result = conn.execute(text(
+            "DELETE FROM usage_quotas WHERE id NOT IN ("
+            "SELECT MIN(id) FROM usage_quotas GROUP BY user_id, quota_month)"
+        ))
+    if result.rowcount:
+        print(f"Merged {result.rowcount} duplicate usage quota rows")
+
+# 作為 INSERT ... ON CONFLICT 衝突目標的唯一索引，缺少時相關寫入必定失敗，因此建立失敗須中止啟動
+CONFLICT_TARGET_INDEXES = frozenset({"uq_quota_user_month", "ix_subscription_plans_name"})
+
+def _create_missing_indexes():
+    """為既有資料表補建新增的索引（create_all 不會修改已存在的資料表）"""
+    existing = set()
+    if IS_SQLITE:
+        # 反射不支援運算式索引，直接由 sqlite_master 取得已存在的索引名稱
+        with engine.connect() as conn:
+            existing = set(conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            ).scalars())
+    
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine, checkfirst=not IS_SQLITE)
+            except Exception as e:
+                # 例如既有資料違反唯一索引，需手動清理後重新啟動
+                print(f"Failed to create index {index.name}: {e}")
+                if index.name in CONFLICT_TARGET_INDEXES:
+                    raise
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _migrate_audio_versions()
 
 def get_db():
     db = SessionLocal()
@@ -200,10 +308,16 @@ def init_all_db():
     # 初始化訂閱相關表格
     from subscription_models import Base as SubscriptionBase
     SubscriptionBase.metadata.create_all(bind=engine)
+    _merge_duplicate_usage_quotas()
+    _create_missing_indexes()
     
     # 初始化預設訂閱方案
     from subscription_service import subscription_service
-    subscription_service.initialize_default_plans()
+    db = SessionLocal()
+    try:
+        subscription_service.initialize_default_plans(db)
+    finally:
+        db.close()
     
     print("All database tables initialized, including subscription system")
 
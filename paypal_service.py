@@ -1,13 +1,18 @@
 import os
 import json
+import zlib
 import asyncio
 import aiohttp
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, timedelta
-from base64 import b64encode
+from base64 import b64encode, b64decode
+from urllib.parse import urlparse
 
 from utils import safe_json_loads, safe_json_dumps
 
+# PayPal Webhook 簽名憑證快取時間
+WEBHOOK_CERT_CACHE_TTL_SECONDS = 3600
+
 class PayPalService:
     """PayPal 支付服務整合"""
     
@@ -25,6 +30,10 @@ class PayPalService:
         
         self.access_token = None
         self.token_expires_at = None
+        
+        # Webhook 設定與簽名憑證快取
+        self.webhook_id = os.getenv("PAYPAL_WEBHOOK_ID")
+        self.webhook_cert_cache: Dict[str, Tuple[datetime, Any]] = {}
     
     async def get_access_token(self) -> str:
         """取得 PayPal 存取權杖"""
@@ -363,22 +372,71 @@ class PayPalService:
                         "status_code": response.status
                     }
     
-    def verify_webhook_signature(self, headers: Dict[str, str], body: str, webhook_id: str) -> bool:
-        """驗證 PayPal Webhook 簽名"""
+    async def get_webhook_certificate(self, cert_url: str):
+        """取得 PayPal Webhook 簽名憑證（快取一段時間，避免每個事件都重新下載）"""
+        
+        cached = self.webhook_cert_cache.get(cert_url)
+        if cached and datetime.utcnow() < cached[0]:
+            return cached[1]
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(cert_url) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"Failed to download PayPal webhook certificate: {error_text}")
+                cert_pem = await response.read()
+        
+        from cryptography import x509
+        certificate = x509.load_pem_x509_certificate(cert_pem)
+        
+        expires_at = datetime.utcnow() + timedelta(seconds=WEBHOOK_CERT_CACHE_TTL_SECONDS)
+        self.webhook_cert_cache[cert_url] = (expires_at, certificate)
+        return certificate
+    
+    async def verify_webhook_signature(self, headers: Dict[str, str], body: bytes, webhook_id: str) -> bool:
+        """驗證 PayPal Webhook 簽名（使用 PayPal 憑證在本地驗證，不需呼叫驗證 API）"""
+        
+        # 參考：https://developer.paypal.com/api/rest/webhooks/rest/#link-selfverificationmethod
+        headers = {key.lower(): value for key, value in headers.items()}
+        
+        auth_algo = headers.get("paypal-auth-algo")
+        transmission_id = headers.get("paypal-transmission-id")
+        cert_url = headers.get("paypal-cert-url")
+        transmission_sig = headers.get("paypal-transmission-sig")
+        transmission_time = headers.get("paypal-transmission-time")
         
-        # 這裡應該實現 PayPal Webhook 簽名驗證
-        # 為了簡化，這裡返回 True，實際應用中需要實現完整的驗證邏輯
+        if not webhook_id:
+            print("PAYPAL_WEBHOOK_ID is not configured, rejecting webhook")
+            return False
         
-        auth_algo = headers.get("PAYPAL-AUTH-ALGO")
-        transmission_id = headers.get("PAYPAL-TRANSMISSION-ID")
-        cert_id = headers.get("PAYPAL-CERT-ID")
-        transmission_sig = headers.get("PAYPAL-TRANSMISSION-SIG")
-        transmission_time = headers.get("PAYPAL-TRANSMISSION-TIME")
+        if not all([transmission_id, cert_url, transmission_sig, transmission_time]):
+            return False
         
-        # 實際驗證邏輯應該在這裡實現
-        # 參考：https://developer.paypal.com/docs/api/webhooks/v1/#verify-webhook-signature
+        if auth_algo and auth_algo != "SHA256withRSA":
+            return False
         
-        return True  # 簡化實現
+        # 只接受 PayPal 網域提供的憑證
+        parsed_url = urlparse(cert_url)
+        if parsed_url.scheme != "https" or not (parsed_url.hostname or "").endswith(".paypal.com"):
+            return False
+        
+        message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(body)}"
+        
+        try:
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.asymmetric import padding
+            
+            certificate = await self.get_webhook_certificate(cert_url)
+            certificate.public_key().verify(
+                b64decode(transmission_sig),
+                message.encode("utf-8"),
+                padding.PKCS1v15(),
+                hashes.SHA256()
+            )
+            return True
+        except Exception as e:
+            print(f"PayPal webhook signature verification failed: {e}")
+            return False
     
     async def process_webhook_event(self, event_data: Dict[str, Any]) -> Dict[str, Any]:
         """處理 PayPal Webhook 事件"""
@@ -150,16 +150,18 @@ async def delete_project(
     
     # 刪除專案目錄
     import shutil
-    from utils import get_upload_path, get_processed_path
+    from utils import get_upload_path, get_processed_path, forget_directory
     
     try:
         upload_dir = get_upload_path(current_user.id, project_id)
         if os.path.exists(upload_dir):
             shutil.rmtree(upload_dir)
+        forget_directory(upload_dir)
         
         processed_dir = get_processed_path(current_user.id, project_id)
         if os.path.exists(processed_dir):
             shutil.rmtree(processed_dir)
+        forget_directory(processed_dir)
     except Exception as e:
         print(f"Warning: Could not delete project directories: {e}")
     
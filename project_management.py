@@ -1,7 +1,9 @@
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from sqlalchemy import delete, exists
 from sqlalchemy.orm import Session
 
 from models_extended import (
@@ -9,9 +11,25 @@ from models_extended import (
 )
 from utils import (
     calculate_quota_usage, get_upload_path, get_processed_path,
-    safe_json_loads, safe_json_dumps, TrimlyException
+    safe_json_dumps, TrimlyException
 )
 
+# 並行取得檔案大小時的最大執行緒數
+_STAT_MAX_WORKERS = 16
+
+# 單位換算常數（以乘法取代除法）
+_BYTES_PER_MB = 1024 * 1024
+_SECONDS_PER_MIN = 60
+_INV_BYTES_PER_MB = 1 / _BYTES_PER_MB
+_INV_SECONDS_PER_MIN = 1 / _SECONDS_PER_MIN
+
+def _get_file_size(file_path: str) -> int:
+    """取得檔案大小，檔案不存在時返回 0"""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
 class ProjectManager:
     """專案管理器"""
     
@@ -47,7 +65,9 @@ class ProjectManager:
             raise TrimlyException("Project not found", "PROJECT_NOT_FOUND")
         
         # 統計音訊檔案
-        audio_files = db.query(AudioFile).filter(AudioFile.project_id == project_id).all()
+        audio_files = db.query(
+            AudioFile.id, AudioFile.duration_seconds, AudioFile.file_path
+        ).filter(AudioFile.project_id == project_id).all()
         total_audio_files = len(audio_files)
         
         # 統計總時長
@@ -56,30 +76,30 @@ class ProjectManager:
         )
         
         # 統計版本數量
-        total_versions = 0
-        for audio in audio_files:
-            versions = db.query(AudioVersion).filter(AudioVersion.audio_file_id == audio.id).count()
-            total_versions += versions
+        audio_file_ids = [audio.id for audio in audio_files]
+        versions = db.query(AudioVersion.file_path).filter(
+            AudioVersion.audio_file_id.in_(audio_file_ids)
+        ).all() if audio_file_ids else []
+        total_versions = len(versions)
+        
+        # 統計檔案大小（原始檔案 + 版本檔案，並行取得檔案大小）
+        file_paths = [audio.file_path for audio in audio_files]
+        file_paths.extend(version.file_path for version in versions if version.file_path)
         
-        # 統計檔案大小
         total_size = 0
-        for audio in audio_files:
-            if os.path.exists(audio.file_path):
-                total_size += os.path.getsize(audio.file_path)
-            
-            # 加上版本檔案大小
-            versions = db.query(AudioVersion).filter(AudioVersion.audio_file_id == audio.id).all()
-            for version in versions:
-                if version.file_path and os.path.exists(version.file_path):
-                    total_size += os.path.getsize(version.file_path)
+        if file_paths:
+            with ThreadPoolExecutor(max_workers=min(_STAT_MAX_WORKERS, len(file_paths))) as executor:
+                total_size = sum(executor.map(_get_file_size, file_paths))
         
         # 統計使用量
-        usage_logs = db.query(UsageLog).filter(UsageLog.user_id == user_id).all()
+        usage_logs = db.query(
+            UsageLog.action, UsageLog.duration_seconds
+        ).filter(UsageLog.user_id == user_id).all()
         
         transcription_minutes = sum(
-            log.duration_seconds / 60 for log in usage_logs 
+            log.duration_seconds for log in usage_logs 
             if log.action == "transcribe"
-        )
+        ) * _INV_SECONDS_PER_MIN
         
         editing_operations = len([
             log for log in usage_logs if log.action == "edit"
@@ -96,8 +116,8 @@ class ProjectManager:
             "updated_at": project.updated_at,
             "total_audio_files": total_audio_files,
             "total_versions": total_versions,
-            "total_duration_minutes": round(total_duration / 60, 2),
-            "total_size_mb": round(total_size / (1024 * 1024), 2),
+            "total_duration_minutes": round(total_duration * _INV_SECONDS_PER_MIN, 2),
+            "total_size_mb": round(total_size * _INV_BYTES_PER_MB, 2),
             "transcription_minutes_used": round(transcription_minutes, 2),
             "editing_operations_count": editing_operations,
             "ai_enhancements_count": ai_enhancements
@@ -118,16 +138,17 @@ class ProjectManager:
         
         cleaned_files = 0
         freed_space = 0
+        version_ids_to_delete = []
         
         # 取得使用者的所有專案
-        projects = db.query(Project).filter(Project.user_id == user_id).all()
+        projects = db.query(Project.id).filter(Project.user_id == user_id).all()
         
         for project in projects:
-            audio_files = db.query(AudioFile).filter(AudioFile.project_id == project.id).all()
+            audio_files = db.query(AudioFile.id).filter(AudioFile.project_id == project.id).all()
             
             for audio_file in audio_files:
                 # 取得所有版本，按建立時間排序
-                versions = db.query(AudioVersion).filter(
+                versions = db.query(AudioVersion.id, AudioVersion.file_path).filter(
                     AudioVersion.audio_file_id == audio_file.id
                 ).order_by(AudioVersion.created_at.desc()).all()
                 
@@ -143,14 +164,21 @@ class ProjectManager:
                             freed_space += file_size
                             cleaned_files += 1
                         
-                        # 刪除資料庫記錄
-                        db.delete(version)
+                        version_ids_to_delete.append(version.id)
+        
+        # 以單一 DELETE 刪除資料庫記錄
+        if version_ids_to_delete:
+            db.execute(
+                delete(AudioVersion)
+                .where(AudioVersion.id.in_(version_ids_to_delete))
+                .execution_options(synchronize_session=False)
+            )
         
         db.commit()
         
         return {
             "cleaned_files": cleaned_files,
-            "freed_space_mb": round(freed_space / (1024 * 1024), 2)
+            "freed_space_mb": round(freed_space * _INV_BYTES_PER_MB, 2)
         }
 
 class VersionManager:
@@ -193,6 +221,7 @@ class VersionManager:
             version_name=version_name,
             file_path=output_path,
             edit_operations=safe_json_dumps([]),
+            edit_operations_count=0,
             edit_summary="Copy of original file",
             duration_seconds=audio_file.duration_seconds,
             file_size_bytes=os.path.getsize(output_path)
@@ -244,6 +273,7 @@ class VersionManager:
             version_name=new_version_name,
             file_path=output_path,
             edit_operations=source_version.edit_operations,
+            edit_operations_count=source_version.edit_operations_count or 0,
             edit_summary=f"Branch from {source_version.version_name}",
             duration_seconds=source_version.duration_seconds,
             file_size_bytes=os.path.getsize(output_path)
@@ -265,29 +295,34 @@ class VersionManager:
         """取得版本歷史"""
         
         # 驗證音訊檔案屬於使用者
-        audio_file = db.query(AudioFile).join(Project).filter(
-            AudioFile.id == audio_file_id,
-            Project.user_id == user_id
-        ).first()
-        
-        if not audio_file:
+        is_owner = db.query(
+            exists().where(
+                AudioFile.id == audio_file_id,
+                AudioFile.project_id == Project.id,
+                Project.user_id == user_id
+            )
+        ).scalar()
+        
+        if not is_owner:
             raise TrimlyException("Audio file not found", "AUDIO_FILE_NOT_FOUND")
         
-        versions = db.query(AudioVersion).filter(
+        versions = db.query(
+            AudioVersion.id, AudioVersion.version_name, AudioVersion.edit_summary,
+            AudioVersion.duration_seconds, AudioVersion.file_size_bytes,
+            AudioVersion.edit_operations_count, AudioVersion.created_at, AudioVersion.file_path
+        ).filter(
             AudioVersion.audio_file_id == audio_file_id
         ).order_by(AudioVersion.created_at.desc()).all()
         
         history = []
         for version in versions:
-            edit_operations = safe_json_loads(version.edit_operations, [])
-            
             history.append({
                 "version_id": version.id,
                 "version_name": version.version_name,
                 "edit_summary": version.edit_summary,
                 "duration_seconds": version.duration_seconds,
                 "file_size_bytes": version.file_size_bytes,
-                "edit_operations_count": len(edit_operations),
+                "edit_operations_count": version.edit_operations_count or 0,
                 "created_at": version.created_at,
                 "can_download": os.path.exists(version.file_path) if version.file_path else False
             })
@@ -298,15 +333,20 @@ class VersionManager:
                         db: Session) -> Dict[str, Any]:
         """比較兩個版本"""
         
-        version1 = db.query(AudioVersion).join(AudioFile).join(Project).filter(
-            AudioVersion.id == version1_id,
-            Project.user_id == user_id
-        ).first()
-        
-        version2 = db.query(AudioVersion).join(AudioFile).join(Project).filter(
-            AudioVersion.id == version2_id,
-            Project.user_id == user_id
-        ).first()
+        # 一次查詢取得兩個版本（同時驗證屬於使用者）
+        versions = {
+            version.id: version
+            for version in db.query(
+                AudioVersion.id, AudioVersion.audio_file_id, AudioVersion.version_name,
+                AudioVersion.duration_seconds, AudioVersion.file_size_bytes,
+                AudioVersion.edit_operations_count, AudioVersion.created_at
+            ).join(AudioFile).join(Project).filter(
+                AudioVersion.id.in_((version1_id, version2_id)),
+                Project.user_id == user_id
+            ).all()
+        }
+        version1 = versions.get(version1_id)
+        version2 = versions.get(version2_id)
         
         if not version1 or not version2:
             raise TrimlyException("One or both versions not found", "VERSION_NOT_FOUND")
@@ -314,9 +354,8 @@ class VersionManager:
         if version1.audio_file_id != version2.audio_file_id:
             raise TrimlyException("Versions must belong to the same audio file", "INVALID_COMPARISON")
         
-        # 解析編輯操作
-        ops1 = safe_json_loads(version1.edit_operations, [])
-        ops2 = safe_json_loads(version2.edit_operations, [])
+        ops1_count = version1.edit_operations_count or 0
+        ops2_count = version2.edit_operations_count or 0
         
         return {
             "version1": {
@@ -324,7 +363,7 @@ class VersionManager:
                 "name": version1.version_name,
                 "duration": version1.duration_seconds,
                 "size": version1.file_size_bytes,
-                "operations_count": len(ops1),
+                "operations_count": ops1_count,
                 "created_at": version1.created_at
             },
             "version2": {
@@ -332,20 +371,22 @@ class VersionManager:
                 "name": version2.version_name,
                 "duration": version2.duration_seconds,
                 "size": version2.file_size_bytes,
-                "operations_count": len(ops2),
+                "operations_count": ops2_count,
                 "created_at": version2.created_at
             },
             "differences": {
                 "duration_diff": (version2.duration_seconds or 0) - (version1.duration_seconds or 0),
                 "size_diff": (version2.file_size_bytes or 0) - (version1.file_size_bytes or 0),
-                "operations_diff": len(ops2) - len(ops1)
+                "operations_diff": ops2_count - ops1_count
             }
         }
     
     def delete_version(self, version_id: int, user_id: int, db: Session) -> Dict[str, Any]:
         """刪除版本"""
         
-        version = db.query(AudioVersion).join(AudioFile).join(Project).filter(
+        version = db.query(
+            AudioVersion.version_name, AudioVersion.file_path
+        ).join(AudioFile).join(Project).filter(
             AudioVersion.id == version_id,
             Project.user_id == user_id
         ).first()
@@ -360,12 +401,11 @@ class VersionManager:
             os.remove(version.file_path)
         
         # 刪除資料庫記錄
-        version_name = version.version_name
-        db.delete(version)
+        db.execute(delete(AudioVersion).where(AudioVersion.id == version_id))
         db.commit()
         
         return {
-            "deleted_version": version_name,
+            "deleted_version": version.version_name,
             "freed_space_bytes": freed_space
         }
 
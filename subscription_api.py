@@ -1,20 +1,80 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
-from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, Tuple
+from pydantic import BaseModel, validator
 
 from subscription_models import (
     SubscriptionPlan, UserSubscription, Payment, UsageQuota, 
     PromoCode, PromoCodeRedemption, Invoice
 )
-from models_extended import User, get_db
+from models_extended import User, SessionLocal, get_db
 from auth import get_current_user, get_current_admin_user
-from subscription_service import subscription_service
+from subscription_service import subscription_service, invalidate_plan_cache, QUOTA_USAGE_COLUMNS
 from paypal_service import paypal_service
-from utils import safe_json_loads, safe_json_dumps
 
 # 建立路由器
-router = APIRouter(prefix="/api/v1/subscription", tags=["Subscription & Payment"])
+router = APIRouter(
+    prefix="/api/v1/subscription",
+    tags=["Subscription & Payment"],
+    default_response_class=ORJSONResponse
+)
+
+# 訂閱方案快取（方案只會透過管理員 API 變更）
+PLANS_CACHE_TTL_SECONDS = 300
+_plans_cache: Dict[str, Tuple[float, bytes, str]] = {}
+
+def _get_cached_plans(key: str) -> Optional[Tuple[bytes, str]]:
+    """取得快取的方案 JSON 及其 ETag，過期則返回 None"""
+    entry = _plans_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1], entry[2]
+    return None
+
+def _set_cached_plans(key: str, data: Any) -> Tuple[bytes, str]:
+    """序列化並快取方案資料，ETag 由內容雜湊產生，確保與回應內容一致"""
+    content = orjson.dumps(jsonable_encoder(data))
+    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+    _plans_cache[key] = (time.monotonic() + PLANS_CACHE_TTL_SECONDS, content, etag)
+    return content, etag
+
+def _invalidate_plans_cache() -> None:
+    """方案變更後清除快取"""
+    _plans_cache.clear()
+    invalidate_plan_cache()
+
+# SubscriptionPlanResponse 需要的欄位，/plans 只查詢這些欄位
+_PLAN_COLS = (
+    SubscriptionPlan.id,
+    SubscriptionPlan.name,
+    SubscriptionPlan.display_name,
+    SubscriptionPlan.price_monthly,
+    SubscriptionPlan.price_yearly,
+    SubscriptionPlan.transcription_minutes_monthly,
+    SubscriptionPlan.ai_enhancements_monthly,
+    SubscriptionPlan.ai_summaries_monthly,
+    SubscriptionPlan.projects_limit,
+    SubscriptionPlan.version_history_limit,
+    SubscriptionPlan.storage_gb,
+    SubscriptionPlan.advanced_ai_features,
+    SubscriptionPlan.priority_processing,
+    SubscriptionPlan.api_access,
+    SubscriptionPlan.white_label
+)
+
+def _get_subscription_by_paypal_id(db: Session, paypal_subscription_id: str) -> Optional[UserSubscription]:
+    """依 PayPal 訂閱 ID 取得本地訂閱"""
+    return db.query(UserSubscription).filter(
+        UserSubscription.paypal_subscription_id == paypal_subscription_id
+    ).first()
 
 # Pydantic 模型
 class SubscriptionPlanResponse(BaseModel):
@@ -37,6 +97,53 @@ class SubscriptionPlanResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SubscriptionPlanCreate(BaseModel):
+    name: str
+    display_name: str
+    price_monthly: float = 0.0
+    price_yearly: float = 0.0
+    transcription_minutes_monthly: int = 30
+    ai_enhancements_monthly: int = 5
+    ai_summaries_monthly: int = 10
+    projects_limit: int = 3
+    version_history_limit: int = 3
+    storage_gb: float = 1.0
+    advanced_ai_features: bool = False
+    priority_processing: bool = False
+    api_access: bool = False
+    white_label: bool = False
+    is_active: bool = True
+    
+    class Config:
+        extra = "forbid"
+
+class SubscriptionPlanUpdate(BaseModel):
+    name: Optional[str] = None
+    display_name: Optional[str] = None
+    price_monthly: Optional[float] = None
+    price_yearly: Optional[float] = None
+    transcription_minutes_monthly: Optional[int] = None
+    ai_enhancements_monthly: Optional[int] = None
+    ai_summaries_monthly: Optional[int] = None
+    projects_limit: Optional[int] = None
+    version_history_limit: Optional[int] = None
+    storage_gb: Optional[float] = None
+    advanced_ai_features: Optional[bool] = None
+    priority_processing: Optional[bool] = None
+    api_access: Optional[bool] = None
+    white_label: Optional[bool] = None
+    is_active: Optional[bool] = None
+    
+    class Config:
+        extra = "forbid"
+    
+    @validator("*", pre=True)
+    def reject_null(cls, value):
+        """欄位可省略但不可明確設為 null（name / display_name 為 NOT NULL，其餘欄位回應模型亦不接受 null）"""
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
 class CreateSubscriptionRequest(BaseModel):
     plan_name: str
     billing_cycle: str = "monthly"  # monthly, yearly
@@ -60,46 +167,60 @@ class UsageQuotaResponse(BaseModel):
 # ==================== 訂閱方案 API ====================
 
 @router.get("/plans", response_model=List[SubscriptionPlanResponse])
-async def get_subscription_plans(db: Session = Depends(get_db)):
-    """取得所有訂閱方案"""
+def get_subscription_plans(request: Request, db: Session = Depends(get_db)):
+    """取得所有訂閱方案（支援 ETag / If-None-Match）"""
+    
+    cached = _get_cached_plans("plans:active")
+    if cached is None:
+        rows = db.query(*_PLAN_COLS).filter(
+            SubscriptionPlan.is_active == True
+        ).order_by(SubscriptionPlan.price_monthly).all()
+        
+        cached = _set_cached_plans(
+            "plans:active", [SubscriptionPlanResponse(**row._mapping) for row in rows]
+        )
+    content, etag = cached
     
-    plans = db.query(SubscriptionPlan).filter(
-        SubscriptionPlan.is_active == True
-    ).order_by(SubscriptionPlan.price_monthly).all()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     
-    return plans
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
 
 @router.get("/plans/{plan_id}", response_model=SubscriptionPlanResponse)
-async def get_subscription_plan(
+def get_subscription_plan(
     plan_id: int,
     db: Session = Depends(get_db)
 ):
     """取得特定訂閱方案"""
     
-    plan = db.query(SubscriptionPlan).filter(
-        SubscriptionPlan.id == plan_id,
-        SubscriptionPlan.is_active == True
-    ).first()
-    
-    if not plan:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Subscription plan not found"
-        )
+    cache_key = f"plan:{plan_id}"
+    cached = _get_cached_plans(cache_key)
+    if cached is None:
+        row = db.query(*_PLAN_COLS).filter(
+            SubscriptionPlan.id == plan_id,
+            SubscriptionPlan.is_active == True
+        ).first()
+        
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Subscription plan not found"
+            )
+        
+        cached = _set_cached_plans(cache_key, SubscriptionPlanResponse(**row._mapping))
     
-    return plan
+    return Response(content=cached[0], media_type="application/json")
 
 # ==================== 使用者訂閱 API ====================
 
 @router.get("/my-subscription")
-async def get_my_subscription(
+def get_my_subscription(
     current_user = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """取得當前使用者的訂閱資訊"""
     
-    subscription = subscription_service.get_user_subscription(current_user.id)
-    plan = subscription_service.get_user_plan(current_user.id)
+    subscription, plan = subscription_service.get_user_subscription_with_plan(db, current_user.id)
     
     if subscription:
         return {
@@ -114,7 +235,7 @@ async def get_my_subscription(
                 "next_billing_date": subscription.next_billing_date,
                 "cancelled_at": subscription.cancelled_at,
                 "expires_at": subscription.expires_at,
-                "days_until_renewal": subscription.days_until_renewal()
+                "days_until_renewal": subscription.days_until_renewal
             },
             "plan": SubscriptionPlanResponse.from_orm(plan)
         }
@@ -133,13 +254,10 @@ async def create_subscription(
 ):
     """建立新訂閱"""
     
-    # 驗證方案存在
-    plan = db.query(SubscriptionPlan).filter(
-        SubscriptionPlan.name == request.plan_name,
-        SubscriptionPlan.is_active == True
-    ).first()
+    # 驗證方案存在（使用服務的方案快取，同步資料庫查詢移到執行緒中，避免阻塞事件迴圈）
+    plan = await asyncio.to_thread(subscription_service.get_plan_by_name, db, request.plan_name)
     
-    if not plan:
+    if not plan or not plan.is_active:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Subscription plan not found"
@@ -155,8 +273,9 @@ async def create_subscription(
     # 驗證促銷代碼（如果提供）
     discount_info = None
     if request.promo_code:
-        promo_validation = subscription_service.validate_promo_code(
-            request.promo_code, current_user.id, plan.id
+        promo_validation = await asyncio.to_thread(
+            subscription_service.validate_promo_code,
+            db, request.promo_code, current_user.id, plan.id
         )
         
         if not promo_validation["valid"]:
@@ -173,7 +292,7 @@ async def create_subscription(
     
     # 建立訂閱
     result = await subscription_service.create_subscription(
-        current_user.id, request.plan_name, request.billing_cycle
+        db, current_user.id, request.plan_name, request.billing_cycle
     )
     
     if result["success"]:
@@ -202,11 +321,12 @@ async def create_subscription(
 @router.post("/cancel")
 async def cancel_subscription(
     reason: str = "User requested cancellation",
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取消訂閱"""
     
-    result = await subscription_service.cancel_subscription(current_user.id, reason)
+    result = await subscription_service.cancel_subscription(db, current_user.id, reason)
     
     if result["success"]:
         return result
@@ -219,14 +339,15 @@ async def cancel_subscription(
 # ==================== 配額管理 API ====================
 
 @router.get("/quota", response_model=UsageQuotaResponse)
-async def get_usage_quota(
+def get_usage_quota(
     month: Optional[str] = None,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """取得使用配額資訊"""
     
-    plan = subscription_service.get_user_plan(current_user.id)
-    quota = subscription_service.get_usage_quota(current_user.id, month)
+    plan = subscription_service.get_user_plan(db, current_user.id)
+    quota = subscription_service.get_usage_quota(db, current_user.id, month)
     
     return UsageQuotaResponse(
         quota_month=quota.quota_month,
@@ -241,39 +362,33 @@ async def get_usage_quota(
     )
 
 @router.get("/quota/check")
-async def check_quota_availability(
+def check_quota_availability(
     resource_type: str,
     amount: float = 1,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """檢查配額是否足夠"""
     
-    available = subscription_service.check_quota_limit(
-        current_user.id, resource_type, amount
-    )
-    
-    plan = subscription_service.get_user_plan(current_user.id)
-    quota = subscription_service.get_usage_quota(current_user.id)
-    
-    # 取得當前使用量和限制
-    if resource_type == "transcription":
-        used = quota.transcription_minutes_used
-        limit = plan.transcription_minutes_monthly
-    elif resource_type == "ai_enhancement":
-        used = quota.ai_enhancements_used
-        limit = plan.ai_enhancements_monthly
-    elif resource_type == "ai_summary":
-        used = quota.ai_summaries_used
-        limit = plan.ai_summaries_monthly
-    elif resource_type == "storage":
-        used = quota.storage_gb_used
-        limit = plan.storage_gb
-    else:
+    try:
+        column_name, limit_name, cast = QUOTA_USAGE_COLUMNS[resource_type]
+    except KeyError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid resource type"
         )
     
+    # 方案與配額各只查詢一次，可用量直接由同一組資料計算
+    plan = subscription_service.get_user_plan(db, current_user.id)
+    quota = subscription_service.get_usage_quota(db, current_user.id)
+    
+    # 取得當前使用量和限制
+    used = getattr(quota, column_name)
+    limit = getattr(plan, limit_name)
+    
+    # 依資源的數值型別換算請求量（與 consume_quota 累加時相同）
+    available = (used + cast(amount)) <= limit
+    
     return {
         "available": available,
         "resource_type": resource_type,
@@ -287,69 +402,48 @@ async def check_quota_availability(
 # ==================== 促銷代碼 API ====================
 
 @router.post("/promo-code/validate")
-async def validate_promo_code(
+def validate_promo_code(
     request: PromoCodeValidationRequest,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     """驗證促銷代碼"""
     
     result = subscription_service.validate_promo_code(
-        request.code, current_user.id, request.plan_id
+        db, request.code, current_user.id, request.plan_id
     )
     
-    if result["valid"]:
-        # 計算折扣預覽
-        plan = db.query(SubscriptionPlan).filter(
-            SubscriptionPlan.id == request.plan_id
-        ).first()
-        
-        if plan:
-            monthly_discount = subscription_service.calculate_discount(
-                plan.price_monthly, result["promo_code"]
-            )
-            yearly_discount = subscription_service.calculate_discount(
-                plan.price_yearly, result["promo_code"]
-            )
-            
-            return {
-                "valid": True,
-                "discount_type": result["discount_type"],
-                "discount_value": result["discount_value"],
-                "monthly_pricing": monthly_discount,
-                "yearly_pricing": yearly_discount
-            }
+    if not result["valid"]:
+        return result
     
-    return result
+    response_data = {
+        "valid": True,
+        "discount_type": result["discount_type"],
+        "discount_value": result["discount_value"]
+    }
+    
+    # 計算折扣預覽（方案已由驗證流程一併取得）
+    plan = result["plan"]
+    if plan:
+        promo_code = result["promo_code"]
+        response_data["monthly_pricing"] = subscription_service.calculate_discount(
+            plan.price_monthly, promo_code
+        )
+        response_data["yearly_pricing"] = subscription_service.calculate_discount(
+            plan.price_yearly, promo_code
+        )
+    
+    return response_data
 
 # ==================== PayPal Webhook API ====================
 
-@router.post("/webhook/paypal")
-async def paypal_webhook(
-    request: Request,
-    db: Session = Depends(get_db)
-):
-    """處理 PayPal Webhook 事件"""
-    
-    # 取得請求資料
-    headers = dict(request.headers)
-    body = await request.body()
-    body_str = body.decode('utf-8')
+async def _process_paypal_event(event_data: Dict[str, Any]):
+    """在背景處理已驗證的 PayPal Webhook 事件（使用獨立的資料庫 session）"""
     
+    db = SessionLocal()
     try:
-        event_data = safe_json_loads(body_str, {})
-        
-        # 驗證 Webhook 簽名（簡化實現）
-        webhook_id = "your-webhook-id"  # 應該從環境變數讀取
-        is_valid = paypal_service.verify_webhook_signature(headers, body_str, webhook_id)
-        
-        if not is_valid:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid webhook signature"
-            )
-        
         # 處理事件
-        result = await paypal_service.process_webhook_event(event_data)
+        await paypal_service.process_webhook_event(event_data)
         
         # 根據事件類型執行相應操作
         event_type = event_data.get("event_type")
@@ -360,27 +454,27 @@ async def paypal_webhook(
             paypal_subscription_id = resource.get("id")
             
             # 找到對應的本地訂閱
-            subscription = db.query(UserSubscription).filter(
-                UserSubscription.paypal_subscription_id == paypal_subscription_id
-            ).first()
+            subscription = await asyncio.to_thread(
+                _get_subscription_by_paypal_id, db, paypal_subscription_id
+            )
             
             if subscription:
                 await subscription_service.activate_subscription(
-                    subscription.id, resource
+                    db, subscription.id, resource
                 )
         
         elif event_type == "BILLING.SUBSCRIPTION.CANCELLED":
             # 訂閱取消
             paypal_subscription_id = resource.get("id")
             
-            subscription = db.query(UserSubscription).filter(
-                UserSubscription.paypal_subscription_id == paypal_subscription_id
-            ).first()
+            subscription = await asyncio.to_thread(
+                _get_subscription_by_paypal_id, db, paypal_subscription_id
+            )
             
             if subscription:
                 subscription.status = "cancelled"
                 subscription.cancelled_at = datetime.utcnow()
-                db.commit()
+                await asyncio.to_thread(db.commit)
         
         elif event_type == "PAYMENT.SALE.COMPLETED":
             # 支付完成
@@ -389,66 +483,123 @@ async def paypal_webhook(
             
             # 記錄支付
             # 這裡需要根據實際需求實現支付記錄邏輯
-        
-        return {"status": "success", "processed": result["processed"]}
-        
+    
     except Exception as e:
-        # 記錄錯誤但不返回錯誤（避免 PayPal 重試）
+        # 回應已送出，只記錄錯誤
         print(f"Webhook processing error: {str(e)}")
-        return {"status": "error", "message": str(e)}
+    
+    finally:
+        db.close()
+
+@router.post("/webhook/paypal")
+async def paypal_webhook(
+    request: Request,
+    background_tasks: BackgroundTasks
+):
+    """處理 PayPal Webhook 事件（驗證後立即回應，事件於背景處理）"""
+    
+    # 取得請求資料（簽名驗證與 JSON 解析都直接使用原始 bytes）
+    headers = dict(request.headers)
+    body = await request.body()
+    
+    # 驗證 Webhook 簽名
+    is_valid = await paypal_service.verify_webhook_signature(
+        headers, body, paypal_service.webhook_id
+    )
+    
+    if not is_valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid webhook signature"
+        )
+    
+    try:
+        event_data = orjson.loads(body) if body else {}
+    except orjson.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid webhook payload"
+        )
+    
+    # 排入背景處理，避免 PayPal 等待逾時後重試
+    background_tasks.add_task(_process_paypal_event, event_data)
+    
+    return {"status": "accepted"}
 
 # ==================== 管理員 API ====================
 
 @router.get("/admin/analytics")
-async def get_subscription_analytics(
-    current_admin = Depends(get_current_admin_user)
+def get_subscription_analytics(
+    current_admin = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
 ):
     """取得訂閱分析資料（管理員專用）"""
     
-    analytics = subscription_service.get_subscription_analytics()
+    analytics = subscription_service.get_subscription_analytics(db)
     return analytics
 
 @router.post("/admin/plans", response_model=SubscriptionPlanResponse)
-async def create_subscription_plan(
-    plan_data: dict,
+def create_subscription_plan(
+    plan_data: SubscriptionPlanCreate,
     current_admin = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
     """建立新的訂閱方案（管理員專用）"""
     
-    plan = SubscriptionPlan(**plan_data)
-    db.add(plan)
+    # INSERT ... RETURNING 直接取回新方案，不需 commit 後再 refresh
+    stmt = (
+        insert(SubscriptionPlan)
+        .values(**plan_data.dict(exclude_unset=True))
+        .returning(*SubscriptionPlan.__table__.c)
+    )
+    try:
+        row = db.execute(stmt).mappings().one()
+    except IntegrityError:
+        # 方案名稱具唯一索引
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Plan name already exists"
+        )
     db.commit()
-    db.refresh(plan)
+    _invalidate_plans_cache()
     
-    return plan
+    return SubscriptionPlanResponse(**row)
 
 @router.put("/admin/plans/{plan_id}", response_model=SubscriptionPlanResponse)
-async def update_subscription_plan(
+def update_subscription_plan(
     plan_id: int,
-    plan_data: dict,
+    plan_data: SubscriptionPlanUpdate,
     current_admin = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
     """更新訂閱方案（管理員專用）"""
     
-    plan = db.query(SubscriptionPlan).filter(
-        SubscriptionPlan.id == plan_id
-    ).first()
+    # 單一 UPDATE ... RETURNING，不需先讀取再寫回
+    stmt = (
+        update(SubscriptionPlan)
+        .where(SubscriptionPlan.id == plan_id)
+        .values(**plan_data.dict(exclude_unset=True))
+        .returning(*SubscriptionPlan.__table__.c)
+    )
+    try:
+        row = db.execute(stmt).mappings().first()
+    except IntegrityError:
+        # 方案名稱具唯一索引
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Plan name already exists"
+        )
     
-    if not plan:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Subscription plan not found"
         )
     
-    for key, value in plan_data.items():
-        if hasattr(plan, key):
-            setattr(plan, key, value)
-    
-    plan.updated_at = datetime.utcnow()
     db.commit()
-    db.refresh(plan)
+    _invalidate_plans_cache()
     
-    return plan
+    return SubscriptionPlanResponse(**row)
 
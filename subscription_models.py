@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Index, and_, or_, cast, func
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from models_extended import Base
 
@@ -8,7 +9,7 @@ class SubscriptionPlan(Base):
     __tablename__ = "subscription_plans"
     
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)  # free, starter, professional, creator
+    name = Column(String, unique=True, nullable=False, index=True)  # free, starter, professional, creator
     display_name = Column(String, nullable=False)  # 免費版, 入門版, 專業版, 創作者版
     price_monthly = Column(Float, default=0.0)  # 月費
     price_yearly = Column(Float, default=0.0)   # 年費
@@ -29,8 +30,8 @@ class SubscriptionPlan(Base):
     
     # 系統欄位
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # 關聯
     subscriptions = relationship("UserSubscription", back_populates="plan")
@@ -55,17 +56,18 @@ class UserSubscription(Base):
     expires_at = Column(DateTime)
     
     # 支付資訊
-    paypal_subscription_id = Column(String)  # PayPal 訂閱 ID
+    paypal_subscription_id = Column(String, unique=True, index=True)  # PayPal 訂閱 ID
     next_billing_date = Column(DateTime)
     
     # 系統欄位
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # 關聯
     plan = relationship("SubscriptionPlan", back_populates="subscriptions")
     payments = relationship("Payment", back_populates="subscription")
     
+    @hybrid_property
     def is_active(self):
         """檢查訂閱是否有效"""
         if self.status != "active":
@@ -76,6 +78,15 @@ class UserSubscription(Base):
             
         return True
     
+    @is_active.expression
+    def is_active(cls):
+        """在 SQL 中判斷訂閱是否有效（可用於 WHERE 條件）"""
+        return and_(
+            cls.status == "active",
+            or_(cls.expires_at.is_(None), func.julianday(cls.expires_at) >= func.julianday("now"))
+        )
+    
+    @hybrid_property
     def days_until_renewal(self):
         """距離下次續費的天數"""
         if not self.next_billing_date:
@@ -83,6 +94,14 @@ class UserSubscription(Base):
         
         delta = self.next_billing_date - datetime.utcnow()
         return max(0, delta.days)
+    
+    @days_until_renewal.expression
+    def days_until_renewal(cls):
+        """在 SQL 中計算距離下次續費的天數（由 SQLite 計算，不需載入整筆資料）"""
+        return func.max(
+            0,
+            cast(func.julianday(cls.next_billing_date) - func.julianday("now"), Integer)
+        )
 
 class Payment(Base):
     """支付記錄"""
@@ -112,8 +131,8 @@ class Payment(Base):
     refunded_at = Column(DateTime)
     
     # 系統欄位
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # 關聯
     subscription = relationship("UserSubscription", back_populates="payments")
@@ -135,8 +154,13 @@ class UsageQuota(Base):
     storage_gb_used = Column(Float, default=0.0)
     
     # 系統欄位
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        # 每位使用者每月只有一筆配額記錄，同時作為查詢索引與 upsert 衝突目標
+        Index("uq_quota_user_month", "user_id", "quota_month", unique=True),
+    )
     
     def __repr__(self):
         return f"<UsageQuota(user_id={self.user_id}, month={self.quota_month})>"
@@ -167,8 +191,8 @@ class PromoCode(Base):
     
     # 系統欄位
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # 關聯
     redemptions = relationship("PromoCodeRedemption", back_populates="promo_code")
@@ -190,6 +214,9 @@ class PromoCode(Base):
         
         return True
 
+# 促銷代碼以不分大小寫比對，使用運算式索引
+Index("idx_promo_code_upper", func.upper(PromoCode.code))
+
 class PromoCodeRedemption(Base):
     """促銷代碼使用記錄"""
     __tablename__ = "promo_code_redemptions"
@@ -209,6 +236,11 @@ class PromoCodeRedemption(Base):
     
     # 關聯
     promo_code = relationship("PromoCode", back_populates="redemptions")
+    
+    __table_args__ = (
+        # 驗證促銷代碼時依使用者與代碼查詢使用記錄
+        Index("idx_redemption_user_promo", "user_id", "promo_code_id"),
+    )
 
 class Invoice(Base):
     """發票記錄"""
@@ -238,8 +270,8 @@ class Invoice(Base):
     billing_address = Column(Text)
     
     # 系統欄位
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
 # 預設訂閱方案資料
 DEFAULT_SUBSCRIPTION_PLANS = [
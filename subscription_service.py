@@ -1,173 +1,271 @@
+import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-from sqlalchemy.orm import Session
+from typing import Dict, Any, Optional, List, Tuple
+from sqlalchemy import and_, exists, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, joinedload
 
 from subscription_models import (
     SubscriptionPlan, UserSubscription, Payment, UsageQuota, 
     PromoCode, PromoCodeRedemption, Invoice, DEFAULT_SUBSCRIPTION_PLANS
 )
-from models_extended import User, SessionLocal
+from models_extended import User
 from paypal_service import paypal_service
 from utils import safe_json_loads, safe_json_dumps
 
+# 資源類型對應的用量欄位、方案上限欄位與數值型別
+QUOTA_USAGE_COLUMNS = {
+    "transcription": ("transcription_minutes_used", "transcription_minutes_monthly", float),
+    "ai_enhancement": ("ai_enhancements_used", "ai_enhancements_monthly", int),
+    "ai_summary": ("ai_summaries_used", "ai_summaries_monthly", int),
+    "storage": ("storage_gb_used", "storage_gb", float)
+}
+
+# 計費週期長度
+_MONTHLY = timedelta(days=30)
+_YEARLY = timedelta(days=365)
+
+# 方案查詢快取（方案很少變動，快取與 session 無關的副本）
+PLAN_CACHE_TTL_SECONDS = 300
+_PLAN_CACHE: Dict[Tuple[str, Any], Tuple[float, SubscriptionPlan]] = {}
+
+def _snapshot_plan(plan: SubscriptionPlan) -> SubscriptionPlan:
+    """複製方案欄位為不屬於任何 session 的物件，可安全跨請求共用"""
+    return SubscriptionPlan(**{
+        column.key: getattr(plan, column.key) for column in SubscriptionPlan.__table__.columns
+    })
+
+def invalidate_plan_cache() -> None:
+    """方案新增或修改後清除快取"""
+    _PLAN_CACHE.clear()
+
+# 配額記錄主鍵快取：(user_id, quota_month) -> id
+# 只快取主鍵，用量數值每次仍由資料庫讀取，因此累加用量時不需清除
+QUOTA_ID_CACHE_TTL_SECONDS = 60
+QUOTA_ID_CACHE_MAX_SIZE = 10000
+_QUOTA_ID_CACHE: Dict[Tuple[int, str], Tuple[float, int]] = {}
+
+# 管理員分析資料快取
+ANALYTICS_CACHE_TTL_SECONDS = 60
+_analytics_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
 class SubscriptionService:
-    """訂閱管理服務"""
+    """訂閱管理服務（不持有 session，由呼叫端傳入請求範圍的資料庫 session）"""
     
-    def __init__(self):
-        self.db = SessionLocal()
+    def initialize_default_plans(self, db: Session):
+        """初始化預設訂閱方案（單一 INSERT，已存在的方案直接略過）"""
+        
+        stmt = sqlite_insert(SubscriptionPlan).values(
+            DEFAULT_SUBSCRIPTION_PLANS
+        ).on_conflict_do_nothing(index_elements=["name"])
+        
+        db.execute(stmt)
+        db.commit()
+        invalidate_plan_cache()
     
-    def initialize_default_plans(self):
-        """初始化預設訂閱方案"""
+    def _get_plan_cached(self, db: Session, cache_key: Tuple[str, Any], *criteria) -> Optional[SubscriptionPlan]:
+        """依條件取得方案，命中快取時不查詢資料庫"""
         
-        for plan_data in DEFAULT_SUBSCRIPTION_PLANS:
-            existing_plan = self.db.query(SubscriptionPlan).filter(
-                SubscriptionPlan.name == plan_data["name"]
-            ).first()
-            
-            if not existing_plan:
-                plan = SubscriptionPlan(**plan_data)
-                self.db.add(plan)
+        entry = _PLAN_CACHE.get(cache_key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
         
-        self.db.commit()
+        plan = db.query(SubscriptionPlan).filter(*criteria).first()
+        if not plan:
+            return None
+        
+        snapshot = _snapshot_plan(plan)
+        _PLAN_CACHE[cache_key] = (time.monotonic() + PLAN_CACHE_TTL_SECONDS, snapshot)
+        return snapshot
+    
+    def get_plan_by_name(self, db: Session, plan_name: str) -> Optional[SubscriptionPlan]:
+        """依名稱取得方案（快取 5 分鐘）"""
+        return self._get_plan_cached(db, ("name", plan_name), SubscriptionPlan.name == plan_name)
     
-    def get_user_subscription(self, user_id: int) -> Optional[UserSubscription]:
+    def get_plan_by_id(self, db: Session, plan_id: int) -> Optional[SubscriptionPlan]:
+        """依 ID 取得方案（快取 5 分鐘）"""
+        return self._get_plan_cached(db, ("id", plan_id), SubscriptionPlan.id == plan_id)
+    
+    def get_user_subscription(self, db: Session, user_id: int) -> Optional[UserSubscription]:
         """取得使用者當前訂閱"""
         
-        return self.db.query(UserSubscription).filter(
+        return db.query(UserSubscription).filter(
             UserSubscription.user_id == user_id,
             UserSubscription.status == "active"
         ).first()
     
-    def get_user_plan(self, user_id: int) -> SubscriptionPlan:
-        """取得使用者當前方案（如果沒有訂閱則返回免費方案）"""
+    def get_user_subscription_with_plan(self, db: Session, user_id: int) -> Tuple[Optional[UserSubscription], SubscriptionPlan]:
+        """取得使用者當前訂閱及方案（訂閱與方案以單一查詢載入）"""
         
-        subscription = self.get_user_subscription(user_id)
+        subscription = db.query(UserSubscription).options(
+            joinedload(UserSubscription.plan)
+        ).filter(
+            UserSubscription.user_id == user_id,
+            UserSubscription.status == "active"
+        ).first()
         
-        if subscription and subscription.is_active():
-            return subscription.plan
+        if subscription and subscription.is_active:
+            return subscription, subscription.plan
         
         # 返回免費方案
-        free_plan = self.db.query(SubscriptionPlan).filter(
-            SubscriptionPlan.name == "free"
-        ).first()
+        return subscription, self.get_plan_by_name(db, "free")
+    
+    def get_user_plan(self, db: Session, user_id: int) -> SubscriptionPlan:
+        """取得使用者當前方案（如果沒有訂閱則返回免費方案）"""
+        
+        # 只查詢方案 ID，方案本身由快取提供，不需建立 ORM 物件
+        plan_id = db.query(UserSubscription.plan_id).filter(
+            UserSubscription.user_id == user_id,
+            UserSubscription.is_active
+        ).limit(1).scalar()
+        
+        if plan_id is not None:
+            plan = self.get_plan_by_id(db, plan_id)
+            if plan:
+                return plan
         
-        return free_plan
+        return self.get_plan_by_name(db, "free")
     
-    def get_usage_quota(self, user_id: int, month: str = None) -> UsageQuota:
+    def get_usage_quota(self, db: Session, user_id: int, month: str = None) -> UsageQuota:
         """取得使用者當月配額使用情況"""
         
         if not month:
             month = datetime.utcnow().strftime("%Y-%m")
         
-        quota = self.db.query(UsageQuota).filter(
+        # 已知主鍵時以 db.get 取得（同一 session 內直接命中 identity map）
+        # SQLite 刪除記錄後可能重複使用 rowid，因此需確認記錄仍屬於同一使用者與月份
+        cache_key = (user_id, month)
+        entry = _QUOTA_ID_CACHE.get(cache_key)
+        if entry and entry[0] > time.monotonic():
+            quota = db.get(UsageQuota, entry[1])
+            if quota and quota.user_id == user_id and quota.quota_month == month:
+                return quota
+        
+        quota_query = db.query(UsageQuota).filter(
             UsageQuota.user_id == user_id,
             UsageQuota.quota_month == month
-        ).first()
+        )
+        quota = quota_query.first()
         
         if not quota:
-            quota = UsageQuota(
-                user_id=user_id,
-                quota_month=month
+            # 併發請求可能同時建立當月記錄，由唯一索引決定，衝突時略過後重新讀取
+            db.execute(
+                sqlite_insert(UsageQuota).values(
+                    user_id=user_id,
+                    quota_month=month
+                ).on_conflict_do_nothing(index_elements=["user_id", "quota_month"])
             )
-            self.db.add(quota)
-            self.db.commit()
-            self.db.refresh(quota)
+            db.commit()
+            quota = quota_query.one()
+        
+        if len(_QUOTA_ID_CACHE) >= QUOTA_ID_CACHE_MAX_SIZE:
+            _QUOTA_ID_CACHE.clear()
+        _QUOTA_ID_CACHE[cache_key] = (time.monotonic() + QUOTA_ID_CACHE_TTL_SECONDS, quota.id)
         
         return quota
     
-    def check_quota_limit(self, user_id: int, resource_type: str, amount: float = 1) -> bool:
+    def check_quota_limit(self, db: Session, user_id: int, resource_type: str, amount: float = 1) -> bool:
         """檢查配額限制"""
         
-        plan = self.get_user_plan(user_id)
-        quota = self.get_usage_quota(user_id)
+        usage_column = QUOTA_USAGE_COLUMNS.get(resource_type)
+        if not usage_column:
+            return False
         
-        if resource_type == "transcription":
-            limit = plan.transcription_minutes_monthly
-            used = quota.transcription_minutes_used
-            return (used + amount) <= limit
-            
-        elif resource_type == "ai_enhancement":
-            limit = plan.ai_enhancements_monthly
-            used = quota.ai_enhancements_used
-            return (used + amount) <= limit
-            
-        elif resource_type == "ai_summary":
-            limit = plan.ai_summaries_monthly
-            used = quota.ai_summaries_used
-            return (used + amount) <= limit
-            
-        elif resource_type == "storage":
-            limit = plan.storage_gb
-            used = quota.storage_gb_used
-            return (used + amount) <= limit
+        column_name, limit_name, cast = usage_column
+        plan = self.get_user_plan(db, user_id)
+        quota = self.get_usage_quota(db, user_id)
         
-        return False
-    
-    def consume_quota(self, user_id: int, resource_type: str, amount: float):
-        """消耗配額"""
-        
-        quota = self.get_usage_quota(user_id)
-        
-        if resource_type == "transcription":
-            quota.transcription_minutes_used += amount
-        elif resource_type == "ai_enhancement":
-            quota.ai_enhancements_used += int(amount)
-        elif resource_type == "ai_summary":
-            quota.ai_summaries_used += int(amount)
-        elif resource_type == "storage":
-            quota.storage_gb_used += amount
-        
-        quota.updated_at = datetime.utcnow()
-        self.db.commit()
+        return getattr(quota, column_name) + cast(amount) <= getattr(plan, limit_name)
     
-    async def create_subscription(self, user_id: int, plan_name: str, 
-                                billing_cycle: str = "monthly") -> Dict[str, Any]:
-        """建立新訂閱"""
+    def consume_quota(self, db: Session, user_id: int, resource_type: str, amount: float):
+        """消耗配額（以單一 INSERT ... ON CONFLICT DO UPDATE 建立或累加當月用量）"""
+        
+        usage_column = QUOTA_USAGE_COLUMNS.get(resource_type)
+        if not usage_column:
+            return
+        
+        column_name, _, cast = usage_column
+        amount = cast(amount)
+        now = datetime.utcnow()
+        
+        stmt = sqlite_insert(UsageQuota).values(
+            user_id=user_id,
+            quota_month=now.strftime("%Y-%m"),
+            **{column_name: amount}
+        ).on_conflict_do_update(
+            index_elements=["user_id", "quota_month"],
+            set_={
+                column_name: getattr(UsageQuota, column_name) + amount,
+                "updated_at": func.now()
+            }
+        )
         
-        # 取得方案
-        plan = self.db.query(SubscriptionPlan).filter(
-            SubscriptionPlan.name == plan_name
-        ).first()
+        db.execute(stmt)
+        db.commit()
+    
+    def _get_new_subscription_context(self, db: Session, user_id: int, 
+                                      plan_name: str) -> Tuple[Optional[SubscriptionPlan], Optional[str], Optional[str]]:
+        """取得建立訂閱所需的方案與使用者 Email，並檢查是否可建立（返回錯誤訊息或 None）"""
         
+        # 取得方案（由方案快取提供，通常不需查詢資料庫）
+        plan = self.get_plan_by_name(db, plan_name)
         if not plan:
-            return {
-                "success": False,
-                "error": "Subscription plan not found"
-            }
+            return None, None, "Subscription plan not found"
         
-        # 取得使用者
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return {
-                "success": False,
-                "error": "User not found"
-            }
+        # 以單一查詢取得使用者 Email 並檢查是否已有活躍訂閱
+        has_active = exists().where(
+            UserSubscription.user_id == User.id,
+            UserSubscription.status == "active"
+        )
+        row = db.query(User.email, has_active).filter(User.id == user_id).first()
+        if not row:
+            return plan, None, "User not found"
+        
+        email, already_subscribed = row
+        if already_subscribed:
+            return plan, email, "User already has an active subscription"
         
-        # 檢查是否已有活躍訂閱
-        existing_subscription = self.get_user_subscription(user_id)
-        if existing_subscription:
+        return plan, email, None
+    
+    def _insert_subscription(self, db: Session, **values) -> int:
+        """新增訂閱記錄並返回 ID"""
+        
+        subscription_id = db.execute(
+            insert(UserSubscription).values(**values).returning(UserSubscription.id)
+        ).scalar_one()
+        db.commit()
+        return subscription_id
+    
+    async def create_subscription(self, db: Session, user_id: int, plan_name: str, 
+                                billing_cycle: str = "monthly") -> Dict[str, Any]:
+        """建立新訂閱（同步資料庫操作在執行緒中執行，不阻塞事件迴圈）"""
+        
+        plan, email, error = await asyncio.to_thread(
+            self._get_new_subscription_context, db, user_id, plan_name
+        )
+        if error:
             return {
                 "success": False,
-                "error": "User already has an active subscription"
+                "error": error
             }
         
         # 免費方案不需要支付
         if plan.name == "free":
-            subscription = UserSubscription(
+            now = datetime.utcnow()
+            subscription_id = await asyncio.to_thread(
+                self._insert_subscription, db,
                 user_id=user_id,
                 plan_id=plan.id,
                 status="active",
                 billing_cycle=billing_cycle,
-                current_period_start=datetime.utcnow(),
-                current_period_end=datetime.utcnow() + timedelta(days=30)
+                current_period_start=now,
+                current_period_end=now + _MONTHLY
             )
             
-            self.db.add(subscription)
-            self.db.commit()
-            
             return {
                 "success": True,
-                "subscription_id": subscription.id,
+                "subscription_id": subscription_id,
                 "requires_payment": False
             }
         
@@ -176,8 +274,8 @@ class SubscriptionService:
             # 準備 PayPal 訂閱資料
             user_data = {
                 "user_id": user_id,
-                "email": user.email,
-                "first_name": user.email.split("@")[0],  # 簡化實現
+                "email": email,
+                "first_name": email.split("@")[0],  # 簡化實現
                 "return_url": "https://trimly.com/subscription/success",
                 "cancel_url": "https://trimly.com/subscription/cancel"
             }
@@ -192,7 +290,8 @@ class SubscriptionService:
             
             if paypal_result["success"]:
                 # 建立本地訂閱記錄
-                subscription = UserSubscription(
+                subscription_id = await asyncio.to_thread(
+                    self._insert_subscription, db,
                     user_id=user_id,
                     plan_id=plan.id,
                     status="pending",  # 等待 PayPal 確認
@@ -200,12 +299,9 @@ class SubscriptionService:
                     paypal_subscription_id=paypal_result["subscription_id"]
                 )
                 
-                self.db.add(subscription)
-                self.db.commit()
-                
                 return {
                     "success": True,
-                    "subscription_id": subscription.id,
+                    "subscription_id": subscription_id,
                     "requires_payment": True,
                     "approve_link": paypal_result["approve_link"],
                     "paypal_subscription_id": paypal_result["subscription_id"]
@@ -223,11 +319,12 @@ class SubscriptionService:
                 "error": f"Error creating subscription: {str(e)}"
             }
     
-    async def activate_subscription(self, subscription_id: int, 
-                                  paypal_subscription_data: Dict[str, Any]) -> Dict[str, Any]:
-        """啟用訂閱（PayPal 確認後）"""
+    def _activate_subscription(self, db: Session, subscription_id: int) -> Dict[str, Any]:
+        """更新訂閱為啟用狀態並調整使用者角色"""
         
-        subscription = self.db.query(UserSubscription).filter(
+        subscription = db.query(UserSubscription).options(
+            joinedload(UserSubscription.plan)
+        ).filter(
             UserSubscription.id == subscription_id
         ).first()
         
@@ -238,37 +335,62 @@ class SubscriptionService:
             }
         
         # 更新訂閱狀態
+        now = datetime.utcnow()
         subscription.status = "active"
-        subscription.started_at = datetime.utcnow()
-        subscription.current_period_start = datetime.utcnow()
+        subscription.started_at = now
+        subscription.current_period_start = now
         
         # 根據計費週期設定結束時間
-        if subscription.billing_cycle == "yearly":
-            subscription.current_period_end = datetime.utcnow() + timedelta(days=365)
-            subscription.next_billing_date = datetime.utcnow() + timedelta(days=365)
-        else:
-            subscription.current_period_end = datetime.utcnow() + timedelta(days=30)
-            subscription.next_billing_date = datetime.utcnow() + timedelta(days=30)
-        
-        subscription.updated_at = datetime.utcnow()
+        period = _YEARLY if subscription.billing_cycle == "yearly" else _MONTHLY
+        subscription.current_period_end = now + period
+        subscription.next_billing_date = now + period
         
         # 更新使用者角色
-        user = self.db.query(User).filter(User.id == subscription.user_id).first()
+        user = db.query(User).filter(User.id == subscription.user_id).first()
         if user:
             user.role = subscription.plan.name
-            user.updated_at = datetime.utcnow()
+            user.updated_at = now
         
-        self.db.commit()
+        db.commit()
         
         return {
             "success": True,
             "message": "Subscription activated successfully"
         }
     
-    async def cancel_subscription(self, user_id: int, reason: str = "User requested") -> Dict[str, Any]:
-        """取消訂閱"""
+    async def activate_subscription(self, db: Session, subscription_id: int, 
+                                  paypal_subscription_data: Dict[str, Any]) -> Dict[str, Any]:
+        """啟用訂閱（PayPal 確認後）"""
         
-        subscription = self.get_user_subscription(user_id)
+        return await asyncio.to_thread(self._activate_subscription, db, subscription_id)
+    
+    def _mark_subscription_cancelled(self, db: Session, subscription: UserSubscription, 
+                                     user_id: int) -> Optional[datetime]:
+        """更新本地訂閱為取消狀態並將使用者降級，返回到期時間"""
+        
+        # 更新本地訂閱狀態
+        now = datetime.utcnow()
+        subscription.status = "cancelled"
+        subscription.cancelled_at = now
+        
+        # 設定到期時間（讓使用者用完當前週期）
+        if not subscription.expires_at:
+            subscription.expires_at = subscription.current_period_end
+        expires_at = subscription.expires_at
+        
+        # 將使用者降級為免費方案
+        user = db.query(User).filter(User.id == user_id).first()
+        if user:
+            user.role = "free"
+            user.updated_at = now
+        
+        db.commit()
+        return expires_at
+    
+    async def cancel_subscription(self, db: Session, user_id: int, reason: str = "User requested") -> Dict[str, Any]:
+        """取消訂閱（同步資料庫操作在執行緒中執行，不阻塞事件迴圈）"""
+        
+        subscription = await asyncio.to_thread(self.get_user_subscription, db, user_id)
         
         if not subscription:
             return {
@@ -290,27 +412,14 @@ class SubscriptionService:
                         "details": paypal_result["error"]
                     }
             
-            # 更新本地訂閱狀態
-            subscription.status = "cancelled"
-            subscription.cancelled_at = datetime.utcnow()
-            subscription.updated_at = datetime.utcnow()
-            
-            # 設定到期時間（讓使用者用完當前週期）
-            if not subscription.expires_at:
-                subscription.expires_at = subscription.current_period_end
-            
-            # 將使用者降級為免費方案
-            user = self.db.query(User).filter(User.id == user_id).first()
-            if user:
-                user.role = "free"
-                user.updated_at = datetime.utcnow()
-            
-            self.db.commit()
+            expires_at = await asyncio.to_thread(
+                self._mark_subscription_cancelled, db, subscription, user_id
+            )
             
             return {
                 "success": True,
                 "message": "Subscription cancelled successfully",
-                "expires_at": subscription.expires_at
+                "expires_at": expires_at
             }
             
         except Exception as e:
@@ -319,19 +428,28 @@ class SubscriptionService:
                 "error": f"Error cancelling subscription: {str(e)}"
             }
     
-    def validate_promo_code(self, code: str, user_id: int, plan_id: int) -> Dict[str, Any]:
+    def validate_promo_code(self, db: Session, code: str, user_id: int, plan_id: int) -> Dict[str, Any]:
         """驗證促銷代碼"""
         
-        promo = self.db.query(PromoCode).filter(
-            PromoCode.code == code.upper()
+        # 代碼與使用者的使用記錄以單一 LEFT JOIN 查詢
+        row = db.query(PromoCode, PromoCodeRedemption.id).outerjoin(
+            PromoCodeRedemption,
+            and_(
+                PromoCodeRedemption.promo_code_id == PromoCode.id,
+                PromoCodeRedemption.user_id == user_id
+            )
+        ).filter(
+            func.upper(PromoCode.code) == code.upper()
         ).first()
         
-        if not promo:
+        if not row:
             return {
                 "valid": False,
                 "error": "Promo code not found"
             }
         
+        promo, redemption_id = row
+        
         if not promo.is_valid():
             return {
                 "valid": False,
@@ -339,12 +457,7 @@ class SubscriptionService:
             }
         
         # 檢查使用者是否已經使用過
-        existing_redemption = self.db.query(PromoCodeRedemption).filter(
-            PromoCodeRedemption.user_id == user_id,
-            PromoCodeRedemption.promo_code_id == promo.id
-        ).first()
-        
-        if existing_redemption:
+        if redemption_id:
             return {
                 "valid": False,
                 "error": "Promo code already used by this user"
@@ -359,9 +472,13 @@ class SubscriptionService:
                     "error": "Promo code not applicable to this plan"
                 }
         
+        # 一併返回方案（由快取提供），呼叫端不需再查詢
+        plan = self.get_plan_by_id(db, plan_id)
+        
         return {
             "valid": True,
             "promo_code": promo,
+            "plan": plan,
             "discount_type": promo.discount_type,
             "discount_value": promo.discount_value
         }
@@ -385,19 +502,42 @@ class SubscriptionService:
             "discount_percentage": (discount_amount / original_amount * 100) if original_amount > 0 else 0
         }
     
-    def get_subscription_analytics(self, user_id: int = None) -> Dict[str, Any]:
-        """取得訂閱分析資料"""
-        
-        query = self.db.query(UserSubscription)
+    def get_subscription_analytics(self, db: Session, user_id: int = None) -> Dict[str, Any]:
+        """取得訂閱分析資料（由 SQL GROUP BY 彙總，整體統計快取 60 秒）"""
+        
+        cache_key = f"analytics:user:{user_id}" if user_id else "analytics:overview"
+        entry = _analytics_cache.get(cache_key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        
+        query = db.query(
+            SubscriptionPlan.name,
+            UserSubscription.status,
+            UserSubscription.billing_cycle,
+            func.count(UserSubscription.id),
+            # 收入只計算活躍訂閱，以 FILTER 子句在資料庫內完成
+            func.sum(SubscriptionPlan.price_monthly).filter(
+                UserSubscription.status == "active",
+                UserSubscription.billing_cycle == "monthly"
+            ),
+            func.sum(SubscriptionPlan.price_yearly).filter(
+                UserSubscription.status == "active",
+                UserSubscription.billing_cycle == "yearly"
+            )
+        ).join(SubscriptionPlan, UserSubscription.plan_id == SubscriptionPlan.id)
         if user_id:
             query = query.filter(UserSubscription.user_id == user_id)
         
-        subscriptions = query.all()
+        rows = query.group_by(
+            SubscriptionPlan.name,
+            UserSubscription.status,
+            UserSubscription.billing_cycle
+        ).all()
         
         analytics = {
-            "total_subscriptions": len(subscriptions),
-            "active_subscriptions": len([s for s in subscriptions if s.status == "active"]),
-            "cancelled_subscriptions": len([s for s in subscriptions if s.status == "cancelled"]),
+            "total_subscriptions": 0,
+            "active_subscriptions": 0,
+            "cancelled_subscriptions": 0,
             "by_plan": {},
             "by_billing_cycle": {},
             "revenue_data": {
@@ -406,26 +546,25 @@ class SubscriptionService:
             }
         }
         
-        for subscription in subscriptions:
-            # 按方案統計
-            plan_name = subscription.plan.name
-            if plan_name not in analytics["by_plan"]:
-                analytics["by_plan"][plan_name] = 0
-            analytics["by_plan"][plan_name] += 1
+        revenue = analytics["revenue_data"]
+        for plan_name, sub_status, billing_cycle, count, monthly_revenue, annual_revenue in rows:
+            analytics["total_subscriptions"] += count
+            if sub_status == "active":
+                analytics["active_subscriptions"] += count
+            elif sub_status == "cancelled":
+                analytics["cancelled_subscriptions"] += count
             
-            # 按計費週期統計
-            billing_cycle = subscription.billing_cycle
-            if billing_cycle not in analytics["by_billing_cycle"]:
-                analytics["by_billing_cycle"][billing_cycle] = 0
-            analytics["by_billing_cycle"][billing_cycle] += 1
+            # 按方案與計費週期統計
+            analytics["by_plan"][plan_name] = analytics["by_plan"].get(plan_name, 0) + count
+            analytics["by_billing_cycle"][billing_cycle] = (
+                analytics["by_billing_cycle"].get(billing_cycle, 0) + count
+            )
             
-            # 收入統計（僅計算活躍訂閱）
-            if subscription.status == "active":
-                if subscription.billing_cycle == "monthly":
-                    analytics["revenue_data"]["monthly_recurring_revenue"] += subscription.plan.price_monthly
-                elif subscription.billing_cycle == "yearly":
-                    analytics["revenue_data"]["annual_recurring_revenue"] += subscription.plan.price_yearly
+            # 收入統計（非活躍或其他週期的群組為 NULL）
+            revenue["monthly_recurring_revenue"] += monthly_revenue or 0
+            revenue["annual_recurring_revenue"] += annual_revenue or 0
         
+        _analytics_cache[cache_key] = (time.monotonic() + ANALYTICS_CACHE_TTL_SECONDS, analytics)
         return analytics
 
 # 全域訂閱服務實例
@@ -1,18 +1,37 @@
 import os
+import json
+import time
 import uuid
 import hashlib
 import mimetypes
+from types import MappingProxyType
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
-import json
+import subprocess
+import jwt
+import orjson
+from passlib.context import CryptContext
+
+# soundfile 為選用套件，未安裝時改用 ffprobe
+try:
+    import soundfile as sf
+except ImportError:
+    sf = None
+
+# 密碼雜湊設定（只建立一次，避免每次呼叫重新載入 bcrypt 後端）
+# 雜湊值內含 rounds，調整後既有密碼仍可驗證；可依主機效能以環境變數調整
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# JWT 設定（啟動時讀取一次）
+JWT_SECRET = os.environ.get("JWT_SECRET", "your-secret-key")
+JWT_ALGORITHM = "HS256"
 
 # 檔案處理工具
 def generate_unique_filename(original_filename: str) -> str:
     """生成唯一的檔案名稱"""
     ext = os.path.splitext(original_filename)[1]
-    unique_id = str(uuid.uuid4())
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{timestamp}_{unique_id}{ext}"
+    return f"{int(time.time())}_{uuid.uuid4().hex}{ext}"
 
 def get_file_info(file_path: str) -> Dict[str, Any]:
     """取得檔案資訊"""
@@ -29,27 +48,66 @@ def get_file_info(file_path: str) -> Dict[str, Any]:
         "modified_at": datetime.fromtimestamp(stat.st_mtime)
     }
 
+def file_digest(file_path: str, algorithm: str = "sha256") -> str:
+    """計算檔案雜湊值（Python 3.11+ 使用 hashlib.file_digest 零複製讀取）"""
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, algorithm).hexdigest()
+        
+        digest = hashlib.new(algorithm)
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def file_sha256(file_path: str) -> str:
+    """計算檔案 SHA-256 雜湊值"""
+    return file_digest(file_path, "sha256")
+
 def ensure_directory(path: str) -> None:
     """確保目錄存在"""
     os.makedirs(path, exist_ok=True)
 
 # 音訊處理工具
+def _read_soundfile_duration(file_path: str) -> Optional[float]:
+    """以 libsndfile 讀取檔頭取得長度（不解碼音訊）"""
+    if sf is None:
+        return None
+    try:
+        info = sf.info(file_path)
+        return info.frames / info.samplerate
+    except Exception:
+        return None
+
+def _probe_duration(file_path: str) -> Optional[float]:
+    """以 ffprobe 取得長度（soundfile 不支援的格式，例如 mp3、m4a）"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "quiet", "-show_entries", "format=duration", "-of", "csv=p=0", file_path],
+        capture_output=True, text=True
+    )
+    output = result.stdout.strip()
+    if result.returncode != 0 or not output:
+        return None
+    return float(output)
+
 def get_audio_duration(file_path: str) -> Optional[float]:
     """取得音訊檔案長度（秒）"""
-    try:
-        import librosa
-        duration = librosa.get_duration(path=file_path)
+    duration = _read_soundfile_duration(file_path)
+    if duration is not None:
         return duration
+    
+    try:
+        return _probe_duration(file_path)
     except Exception as e:
         print(f"Error getting audio duration: {e}")
         return None
 
 def validate_audio_file(file_path: str) -> bool:
-    """驗證是否為有效的音訊檔案"""
-    try:
-        import librosa
-        librosa.load(file_path, duration=1)  # 只載入1秒來測試
+    """驗證是否為有效的音訊檔案（只讀取檔頭，不解碼）"""
+    if _read_soundfile_duration(file_path) is not None:
         return True
+    
+    try:
+        return _probe_duration(file_path) is not None
     except Exception:
         return False
 
@@ -60,22 +118,15 @@ def normalize_email(email: str) -> str:
 
 def hash_password(password: str) -> str:
     """密碼雜湊"""
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """驗證密碼"""
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     return pwd_context.verify(plain_password, hashed_password)
 
 # JWT 工具
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """建立 JWT token"""
-    import jwt
-    from datetime import datetime, timedelta
-    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -84,52 +135,49 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     
     to_encode.update({"exp": expire})
     
-    secret_key = os.environ.get("JWT_SECRET", "your-secret-key")
-    encoded_jwt = jwt.encode(to_encode, secret_key, algorithm="HS256")
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> Optional[Dict[str, Any]]:
     """驗證 JWT token"""
-    import jwt
-    
     try:
-        secret_key = os.environ.get("JWT_SECRET", "your-secret-key")
-        payload = jwt.decode(token, secret_key, algorithms=["HS256"])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         return payload
     except jwt.PyJWTError:
         return None
 
 # 用量計算工具
+# 各角色配額（靜態資料，模組載入時建立一次並設為唯讀）
+_QUOTAS = MappingProxyType({
+    "free": {
+        "monthly_minutes": 30,
+        "ai_enhance_minutes": 1,
+        "ai_summary_count": 5,
+        "max_versions": 3
+    },
+    "starter": {
+        "monthly_minutes": 300,  # 5小時
+        "ai_enhance_minutes": 10,
+        "ai_summary_count": 50,
+        "max_versions": 10
+    },
+    "pro": {
+        "monthly_minutes": 1200,  # 20小時
+        "ai_enhance_minutes": 60,
+        "ai_summary_count": 200,
+        "max_versions": 30
+    },
+    "creator": {
+        "monthly_minutes": -1,  # 無限制
+        "ai_enhance_minutes": -1,
+        "ai_summary_count": -1,
+        "max_versions": 50
+    }
+})
+
 def calculate_quota_usage(user_role: str) -> Dict[str, int]:
     """計算使用者配額"""
-    quotas = {
-        "free": {
-            "monthly_minutes": 30,
-            "ai_enhance_minutes": 1,
-            "ai_summary_count": 5,
-            "max_versions": 3
-        },
-        "starter": {
-            "monthly_minutes": 300,  # 5小時
-            "ai_enhance_minutes": 10,
-            "ai_summary_count": 50,
-            "max_versions": 10
-        },
-        "pro": {
-            "monthly_minutes": 1200,  # 20小時
-            "ai_enhance_minutes": 60,
-            "ai_summary_count": 200,
-            "max_versions": 30
-        },
-        "creator": {
-            "monthly_minutes": -1,  # 無限制
-            "ai_enhance_minutes": -1,
-            "ai_summary_count": -1,
-            "max_versions": 50
-        }
-    }
-    
-    return quotas.get(user_role, quotas["free"])
+    return _QUOTAS.get(user_role, _QUOTAS["free"])
 
 def check_quota_limit(user, action: str, amount: int = 1) -> bool:
     """檢查是否超過配額限制"""
@@ -153,34 +201,55 @@ def check_quota_limit(user, action: str, amount: int = 1) -> bool:
     return False
 
 # 檔案路徑工具
+# 已建立過的目錄，避免每次請求重複 makedirs（刪除目錄時需呼叫 forget_directory）
+_created_directories = set()
+
+def _ensure_directory_cached(path: str) -> None:
+    """確保目錄存在，同一路徑只建立一次"""
+    if path not in _created_directories:
+        ensure_directory(path)
+        _created_directories.add(path)
+
+def forget_directory(path: str) -> None:
+    """目錄被刪除後移除記錄，下次取得路徑時會重新建立"""
+    _created_directories.discard(path)
+
 def get_upload_path(user_id: int, project_id: int) -> str:
     """取得上傳檔案的儲存路徑"""
     base_path = os.environ.get("UPLOAD_PATH", "/var/data/uploads")
     path = os.path.join(base_path, str(user_id), str(project_id))
-    ensure_directory(path)
+    _ensure_directory_cached(path)
     return path
 
 def get_processed_path(user_id: int, project_id: int) -> str:
     """取得處理後檔案的儲存路徑"""
     base_path = os.environ.get("PROCESSED_PATH", "/var/data/processed")
     path = os.path.join(base_path, str(user_id), str(project_id))
-    ensure_directory(path)
+    _ensure_directory_cached(path)
     return path
 
 # JSON 處理工具
 def safe_json_loads(json_str: str, default=None):
     """安全的 JSON 解析"""
+    if not json_str:
+        return default
     try:
-        return json.loads(json_str) if json_str else default
-    except (json.JSONDecodeError, TypeError):
+        return orjson.loads(json_str)
+    except orjson.JSONDecodeError:
+        # 舊資料由 json.dumps 寫入，可能含有 orjson 不接受的 NaN/Infinity
+        try:
+            return json.loads(json_str)
+        except (json.JSONDecodeError, TypeError):
+            return default
+    except TypeError:
         return default
 
 def safe_json_dumps(obj, default=None) -> str:
     """安全的 JSON 序列化"""
     try:
-        return json.dumps(obj, ensure_ascii=False, default=str)
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
     except (TypeError, ValueError):
-        return json.dumps(default) if default is not None else "{}"
+        return orjson.dumps(default).decode() if default is not None else "{}"
 
 # 錯誤處理工具
 class TrimlyException(Exception):